@@ -1,354 +1,139 @@
 # Needed imports
 import sys                      # for exit on error
-import math                     # for pi
 import json                     # for reading json files
 import random                   # for dice values
 import functools                # for some utility functions
+import time                     # for measuring event handling
 from datetime import timedelta  # for time periods
+import os                       # for optional files
 import Gempyre                  # for UI
 from Gempyre_utils import resource
+from game import Geometry, Game  # for game rules
+from tablebase import Tablebase  # for endgame decisions
+from decisions import DecisionCache, policy_stamp  # for repeated decisions
+from evaluator import Evaluator  # for learned decisions
 
-# The mouse click radius outside drawing radius
-FEATHER = 10
 # HTML Unicode value for dice graphics
 DICE_FACE = '&#127922;'
 # HTML Unicode value for a 1st die value
 DIE_1 = 9856
 # Seconds to show the current die value, when not waiting for user
 DICE_WAIT = 1.5
+# Mouse move events are sent from UI at most this often
+HOVER_MIN_INTERVAL = 0.02
+# ...and handled at most this seldom
+HOVER_MAX_INTERVAL = 0.3
+# Handling interval until the client round trip is measured
+HOVER_START_INTERVAL = 0.1
+# Handling interval as multiple of the measured handling and round trip time
+HOVER_LOAD = 4
+# Client round trip is measured after every this many handled events
+HOVER_PROBE_EVERY = 10
+# Optional endgame tablebase, generated with tablebase.py
+ENDGAME_TABLE = 'gui/endgame.tb'
+# Optional move evaluator weights, trained with selfplay.py
+EVALUATOR_FILE = 'gui/evaluator.json'
+# Auto-play decisions persisted between runs
+DECISION_FILE = 'gui/decisions.json'
 
-isometric_draw = False
-
-
-# A peg goes in slot
-class Peg:
-    def __init__(self, color, slot):
-        self.color = color
-        self.slot = slot
-        self.position = 0
-
-    def draw(self, frame):
-        frame.begin_path()
-        self.slot.draw_ellipse(frame)
-        frame.fill_style(self.color)
-        frame.fill()
-
-    def reset(self, slot):
-        self.slot.peg = None
-        slot.peg = self
-        self.slot = slot
-        self.position = 0
-
-
-# Game is set of slots
-class Slot:
-    def __init__(self, d, owner, color="black"):
-        self.x = float(d['x'])
-        self.y = float(d['y'])
-        self.size = float(d['size'])
-        self.selected = False
-        self.peg = Peg(d['color'], self) if d['color'] else None
-        self.color = color
-        self.owner = owner
-        self.hilit = False
-        self.isometric = True
-
-    def draw_ellipse(self, frame):
-        if isometric_draw:
-            frame.save()
-            frame.scale(1, 0.5)
-            frame.arc(self.x, self.y, self.size, 0, 2 * math.pi)
-            frame.restore()
-        else:
-            frame.arc(self.x, self.y, self.size, 0, 2 * math.pi)
-
-    def draw(self, frame):
-        frame.begin_path()
-        self.draw_ellipse(frame)
-        frame.stroke_style(self.color)
-        frame.stroke()
-
-        if self.hilit:
-            frame.begin_path()
-            self.draw_ellipse(frame)
-            frame.fill_style('#1B1B1B2F')
-            frame.fill()
-
-        if self.selected:
-            frame.begin_path()
-            self.draw_ellipse(frame)
-            frame.stroke_style('#2F2F2F')
-            frame.stroke()
-
-        if self.peg:
-            self.peg.draw(frame)
-
-    def is_in(self, x, y):
-        return math.fabs(self.x - x) <= (self.size + FEATHER) \
-               and math.fabs(self.y - y) <= (self.size + FEATHER)
-
-    def move(self, other, steps):
-        assert self.peg
-        assert not other.peg
-        self.peg.position += steps
-        self.peg.slot = other
-        other.peg = self.peg
-        self.peg = None
-
-
-class Ring:
-    def __init__(self, d):
-        self.x = d['x']
-        self.y = d['y']
-        self.slots = [Slot(s, self) for s in d['slots']]
-
-    def draw(self, frame):
-        for s in self.slots:
-            s.draw(frame)
-
-    def slot_at(self, x, y):
-        for s in self.slots:
-            if s.is_in(x, y):
-                return s
-        return None
-
-    def activate(self, color, target):
-        selected = []
-        for s in self.slots:
-            if s.peg and s.peg.color == color and target(s):
-                s.selected = True
-                selected.append(s)
-            else:
-                s.selected = False
-        return selected
-
-    def deactivate(self):
-        for s in self.slots:
-            s.selected = False
-
-
-class Home:
-    def __init__(self, d):
-        self.color = d['color']
-        self.entry = int(d['entry'])
-        self.slots = [Slot(s, self, self.color) for s in d['slots']]
-
-    def draw(self, frame):
-        for s in self.slots:
-            s.draw(frame)
-
-    def slot_at(self, x, y):
-        for s in self.slots:
-            if s.is_in(x, y):
-                return s
-        return None
-
-    def count(self):
-        return len([s for s in self.slots if s.peg])
-
-
-class Start(Home):
-    def __init__(self, d):
-        super().__init__(d)
-
-    def activate(self, target):
-        for s in self.slots:
-            if s.peg and target(s):
-                s.selected = True
-                return s
-        return None
-
-    def deactivate(self):
-        for s in self.slots:
-            s.selected = False
-
-    def is_active(self):
-        return functools.reduce(lambda a, b: a or b, self.slots)
-
-    def return_home(self, peg):
-        for s in self.slots:
-            if not s.peg:
-                peg.reset(s)
-                return
 
+AUTO_PLAY_ON = 1
+AUTO_PLAY_PENDING = 2
+AUTO_PLAY_DECIDE = 4
 
-class Goals(Home):
-    def __init__(self, d):
-        super().__init__(d)
-
-    def is_full(self):
-        return len([s for s in self.slots if s.peg]) == len(self.slots)
-
-
-class Player:
-    def __init__(self, color, name):
-        self.color = color
-        self.name = name.rstrip()
-        self.current_dice = -1
-
-
-class Game:
-    START = 1
-    PICK_MOVER = 2
-    SELECT_STARTER = 3
-    NEXT_TURN = 4
-    GAME_OVER = 5
-
-    NEW_RING = 6
-    MIN_PLAYERS = 2
-
-    def __init__(self, data, help_function):
-        self.width = data['width']
-        self.height = data['height']
-        self.ring = Ring(data['ring'])
-        self.starts = {s['color']: Start(s) for s in data['starts']}
-        self.goals = {s['color']: Goals(s) for s in data['goals']}
-        self.state = self.START
-        self.players = []
-        self.player_turn = 0
-        self.help = help_function
-        self.is_new_ring = False
-        self.selected = None
-
-    def draw(self, frame_composer):
-        self.ring.draw(frame_composer)
-        for s in self.starts.values():
-            s.draw(frame_composer)
-        for g in self.goals.values():
-            g.draw(frame_composer)
-
-    def slot_at(self, x, y):
-        return self.ring.slot_at(x, y) or self.current_start().slot_at(x, y) or self.current_goal().slot_at(x, y)
-
-    def clicked(self, x, y):
-        assert self.state == self.PICK_MOVER
-        self.selected = None
-        slot = self.slot_at(x, y)
-        print("hit at", slot, slot.peg.color if slot and slot.peg else "Empty")
-        if slot and slot.peg and slot.peg.color == self.current_player().color and (
-                self.is_new_ring or slot.owner == self.ring):
-            target = self.target_slot(slot)
-            if not target:
-                return False
-            if target.peg:
-                self.starts[target.peg.color].return_home(target.peg)
-            self.ring.deactivate()
-            self.current_start().deactivate()
-            if slot.owner == self.current_start():
-                slot.move(target, 0)
-            else:
-                slot.move(target, self.current_player().current_dice)
-            self.state = self.NEXT_TURN
-            if self.is_new_ring:
-                return True
-            return self.turn_inc()
-        return False
-
-    def player(self, color):
-        for n in self.players:
-            if n.color == color:
-                return n
-        return None
-
-    def current_player(self):
-        return self.players[self.player_turn] if self.player_turn < len(self.players) else None
 
-    def set_players(self, player_names):
-        self.players = [Player(p, player_names[p]) for p in player_names if player_names[p]]
-        if len(self.players) < self.MIN_PLAYERS:
+# Adapts the interval of a frequent event to the measured time of handling it and of
+# a client round trip. 'probe' is a query to the client, as it is answered only after the
+# client has processed the frames sent before it, its time tells the frame delivery latency.
+# Events arriving too early are dropped, except the newest that is handled when the interval elapses.
+class AdaptiveThrottle:
+    def __init__(self, ui, handler, probe, start_interval, min_interval, max_interval, load, probe_every):
+        self.ui = ui
+        self.handler = handler
+        self.probe = probe
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.load = load
+        self.probe_every = probe_every
+        self.interval = start_interval
+        self.cost = 0.0
+        self.latency = None
+        self.handled = 0
+        self.last = 0.0
+        self.pending = None
+
+    def __call__(self, event):
+        wait = self.last + self.interval - time.perf_counter()
+        if wait <= 0:
+            # an older event may wait for its flush, this one is newer
+            self.pending = None
+            self.handle(event)
             return
-        self.state = self.SELECT_STARTER
-        self.player_turn = 0
-        self.help(self.current_player().name.capitalize() + " throws the dice to see who will be the first.")
-
-    def current_color(self):
-        return self.current_player().color if self.current_player() else 'white'
-
-    def current_start(self):
-        return self.starts[self.current_player().color]
-
-    def current_goal(self):
-        return self.goals[self.current_player().color]
-
-    def turn_inc(self):
-        self.player_turn += 1
-        if self.player_turn >= len(self.players):
-            for k in self.goals:
-                if self.goals[k].is_full():
-                    self.help(self.player(k).name + " won!")
-                    self.state = self.GAME_OVER
-                    return False
-            self.player_turn = 0
-        return True
-
-    def dice_thrown(self, value):
-        self.is_new_ring = value == self.NEW_RING
-        self.players[self.player_turn].current_dice = value
-        if self.state == self.SELECT_STARTER:
-            self.turn_inc()
-            if len([s for s in self.players if s.current_dice < 1]) == 0:
-                self.players.sort(key=lambda x: x.current_dice, reverse=True)
-                self.state = self.NEXT_TURN
-                self.player_turn = 0
-                self.help(self.current_player().name.capitalize() + " will start the game!")
-            else:
-                self.help(self.current_player().name.capitalize() + " throws the dice to see who will be the first.")
-            return True
-        elif self.state == self.NEXT_TURN:
-            assert not self.selected
-            self.selected = self.ring.activate(self.current_player().color, self.target_slot)
-            if value == self.NEW_RING:
-                activated_start = self.current_start().activate(self.target_slot)
-                if activated_start:
-                    self.selected.append(activated_start)
-            if len(self.selected) == 0:
-                if self.turn_inc():
-                    self.help("Cannot move, pass turn to " + self.current_player().name.capitalize())
-                return True
-            self.help(self.current_player().name.capitalize() + " do your move.")
-            self.state = self.PICK_MOVER
-        elif self.state == self.PICK_MOVER:
-            None
+        if self.pending is None:
+            self.ui.after(timedelta(seconds=wait), self.flush)
+        self.pending = event
+
+    def flush(self):
+        event = self.pending
+        self.pending = None
+        if event is not None:
+            self.handle(event)
+
+    def handle(self, event):
+        begin = time.perf_counter()
+        self.handler(event)
+        self.last = time.perf_counter()
+        # smoothed, so a single slow frame does not freeze the hover
+        self.cost = 0.8 * self.cost + 0.2 * (self.last - begin)
+        if self.handled % self.probe_every == 0:
+            self.probe()
+            round_trip = time.perf_counter() - self.last
+            self.latency = round_trip if self.latency is None else 0.8 * self.latency + 0.2 * round_trip
+            self.last = time.perf_counter()
+        self.handled += 1
+        if self.latency is not None:
+            self.interval = min(max((self.cost + self.latency) * self.load, self.min_interval), self.max_interval)
+
+
+# Merges all UI changes caused by one event into a single message to the browser.
+# Use as 'with batch:' or as a handler decorator, redraws within are done once at the end.
+# Note: do not query element values within a batch, read them before.
+class Batch:
+    def __init__(self, ui, draw):
+        self.ui = ui
+        self.draw = draw
+        self.depth = 0
+        self.dirty = False
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.ui.begin_batch()
+        self.depth += 1
+        return self
+
+    def __exit__(self, *_):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                if self.dirty:
+                    self.dirty = False
+                    self.draw()
+            finally:
+                self.ui.end_batch()
         return False
 
-    def target_slot(self, slot):
-        assert slot.peg  # Slot must have a color!
-        assert slot.peg.color == self.current_color()  # Assumed that same as the current color!
-        assert 1 <= self.current_player().current_dice <= 6  # Shall have a valid die value!
-
-        # If slot in ring
-        if slot.owner == self.ring:
-            slot_count = len(self.ring.slots)
-            target_pos = slot.peg.position + self.current_player().current_dice
-            if target_pos < slot_count:
-                position = (target_pos + self.current_start().entry) % slot_count
-                if not self.ring.slots[position].peg or self.ring.slots[position].peg.color != self.current_color():
-                    return self.ring.slots[position]
-            # It tries to go goal
-            else:
-                goal_position = target_pos - slot_count
-                # if we can fit it in
-                if goal_position < len(self.current_goal().slots) and not self.current_goal().slots[goal_position].peg:
-                    return self.current_goal().slots[goal_position]
-                # is it one of starts, and can we go (or event eat)?
-        elif slot.owner == self.current_start() and self.current_start().is_active():
-            start_pos = self.current_start().entry
-            if not self.ring.slots[start_pos].peg or self.ring.slots[start_pos].peg.color != self.current_color():
-                return self.ring.slots[start_pos]
-        return None
-
-    def get_activated(self):
-        return [s for s in self.ring.slots if s.selected] + [s for s in self.current_start().slots if s.selected]
-
-    @staticmethod
-    def set_draw_mode(mode):
-        global isometric_draw
-        isometric_draw = True if mode == 'isometric' else False
-
+    def __call__(self, handler):
+        @functools.wraps(handler)
+        def batched(*args):
+            with self:
+                return handler(*args)
+        return batched
 
-AUTO_PLAY_ON = 1
-AUTO_PLAY_PENDING = 2
-AUTO_PLAY_DECIDE = 4
+    def redraw(self):
+        if self.depth > 0:
+            self.dirty = True
+        else:
+            self.draw()
 
 
 def main():
@@ -383,8 +168,26 @@ def main():
     with open("gui/data.json", 'r') as f:
         data = json.load(f)
 
+    # Geometry is shared by all games
+    geometry = Geometry(data)
+
+    # Endgame tablebase is used for auto decisions, if generated for this board
+    endgame = Tablebase(ENDGAME_TABLE) if os.path.exists(ENDGAME_TABLE) else None
+    if endgame and not endgame.matches(geometry):
+        print("Ignore", ENDGAME_TABLE, "generated for another board")
+        endgame.close()
+        endgame = None
+
+    # Learned evaluator is used when the position is not in the tablebase
+    evaluator = Evaluator.load(EVALUATOR_FILE) if os.path.exists(EVALUATOR_FILE) else None
+
+    # Decisions are kept over games and runs, as long as the tablebase and evaluator stay the same
+    decisions = DecisionCache(policy=policy_stamp(ENDGAME_TABLE, EVALUATOR_FILE))
+    if os.path.exists(DECISION_FILE):
+        decisions.load(DECISION_FILE)
+
     # Create Game object
-    game = Game(data, lambda string: instructions.set_html(string))
+    game = Game(geometry, lambda string: instructions.set_html(string))
 
     initial_help = "Provide players names before start."
     game.help(initial_help)
@@ -439,16 +242,21 @@ def main():
     ui.on_open(on_open)
 
     # Function that wipes previous draw and draw a new frame
-    def redraw():
+    def draw_frame():
         fc = Gempyre.FrameComposer()
         fc.clear_rect(Gempyre.Rect(0, 0, game.width, game.height))
         game.draw(fc)
         canvas.draw_frame(fc)
 
+    # UI changes of an event are sent together, and the frame is drawn only once
+    batch = Batch(ui, draw_frame)
+    redraw = batch.redraw
+
     def start_auto_play():
         nonlocal auto_play_state
         auto_play_state |= AUTO_PLAY_ON
 
+        @batch
         def auto_play(tid):
             nonlocal auto_play_state
             if not auto_play_state & AUTO_PLAY_ON:
@@ -476,8 +284,18 @@ def main():
                     print("clicx")
                     send_click(0)
                 elif game.selected and auto_play_state & AUTO_PLAY_DECIDE:
-                    print("guess")
-                    send_click(random.randint(0, len(game.selected) - 1))
+                    # tablebase is a lookup as such, only evaluator decisions are worth caching
+                    best = endgame.best_move(game) if endgame else None
+                    if best is None and evaluator:
+                        best = decisions.lookup(game)
+                        if best is None:
+                            best = evaluator.best_move(game)
+                            decisions.store(game, best)
+                    if best is not None:
+                        send_click(best)
+                    else:
+                        print("guess")
+                        send_click(random.randint(0, len(game.selected) - 1))
                 else:
                     print("stop")
                     auto_play_state |= AUTO_PLAY_PENDING
@@ -488,9 +306,15 @@ def main():
 
     # Function called when a Start button is clicked.
     def on_start(_):
-        nonlocal auto_play_state
-        # the names in those elements
+        # the names in those elements, and auto play options - read before batching
         names = {color: name_elements[color].values()['value'] for color in colors}
+        auto_decide = Gempyre.Element(ui, 'auto_decide').values()['checked'] == 'true'
+        auto_start = Gempyre.Element(ui, 'auto_start').values()['checked'] == 'true'
+        with batch:
+            start_game(names, auto_decide, auto_start)
+
+    def start_game(names, auto_decide, auto_start):
+        nonlocal auto_play_state
         # Apply those to UI
         game.set_players(names)
         # If game state still start
@@ -507,15 +331,16 @@ def main():
         # Show dice (using styles - for some reason attribute wont work)
         dice.set_style('visibility', 'visible')
         # Set auto play mode
-        if Gempyre.Element(ui, 'auto_decide').values()['checked'] == 'true':
+        if auto_decide:
             auto_play_state |= AUTO_PLAY_DECIDE
-        if Gempyre.Element(ui, 'auto_start').values()['checked'] == 'true':
+        if auto_start:
             start_auto_play()
 
     # Subscribe the start button.
     start.subscribe('click', on_start)
 
     # Function called when next throw is expected.
+    @batch
     def next_dice():
         print("next dice")
         # Python trick to refer outer scope variable.
@@ -535,6 +360,7 @@ def main():
             start_auto_play()
 
     # Function called when dice will be thrown.
+    @batch
     def throw_dice(number):
         nonlocal next_dice_ok
         if not next_dice_ok:
@@ -563,6 +389,7 @@ def main():
     ui.root().subscribe('keydown', key_down, ['keyCode'])
 
     # Function that shows targets
+    @batch
     def show_targets(e):
         nonlocal hilit_slot
         nonlocal canvas_rect
@@ -573,7 +400,7 @@ def main():
             y = float(e.properties['clientY'])
             x -= canvas_rect.x
             y -= canvas_rect.y
-            y = y * 2 if isometric_draw else y
+            y = y * 2 if Game.is_isometric() else y
             target = game.slot_at(x, y)
             if target and target.peg and target.peg.color == game.current_player().color and (
                     game.is_new_ring or target.owner == game.ring):
@@ -591,11 +418,19 @@ def main():
                 hilit_slot = None
             redraw()
 
-    # Subscribe mouse moves, they get often - thus we filter ones coming < 100ms from previous
-    canvas.subscribe('mousemove', show_targets,
-                     ["clientX", "clientY"], timedelta(milliseconds=100))
+    # Query that returns when the client has drawn the frames sent before, keeps canvas position fresh too
+    def probe_client():
+        nonlocal canvas_rect
+        canvas_rect = canvas.rect()
+
+    # Subscribe mouse moves, they get often - thus we filter them by the time it takes to handle and draw one
+    canvas.subscribe('mousemove',
+                     AdaptiveThrottle(ui, show_targets, probe_client, HOVER_START_INTERVAL,
+                                      HOVER_MIN_INTERVAL, HOVER_MAX_INTERVAL, HOVER_LOAD, HOVER_PROBE_EVERY),
+                     ["clientX", "clientY"], timedelta(seconds=HOVER_MIN_INTERVAL))
 
     # mouse click handler
+    @batch
     def on_click(event):
         nonlocal next_dice_ok
         nonlocal hilit_slot
@@ -616,6 +451,8 @@ def main():
             next_dice()
         elif game.state == game.GAME_OVER:
             restart.remove_attribute('hidden')
+            decisions.save(DECISION_FILE)
+            print("decisions", decisions.stats())
         else:
             assert not auto_play_state & AUTO_PLAY_ON
         print("draw")
@@ -625,6 +462,7 @@ def main():
     # subscribe clicks
     canvas.subscribe('click', on_click, ["clientX", "clientY"])
 
+    @batch
     def on_reset(_):
         nonlocal auto_play_state
         nonlocal hilit_slot
@@ -634,7 +472,7 @@ def main():
         auto_play_state = 0
         hilit_slot = None
         next_dice_ok = None
-        game = Game(data, game.help)
+        game = Game(geometry, game.help)
         game.help(initial_help)
         for k in name_elements:
             name_elements[k].remove_attribute('disabled')
@@ -646,7 +484,8 @@ def main():
 
     def on_set_draw_mode(_):
         game.set_draw_mode(draw_mode.values()['value'])
-        redraw()
+        with batch:
+            redraw()
 
     restart.subscribe('click', on_reset)
 
@@ -0,0 +1,114 @@
+# Bounded cache of auto-play decisions, keyed by position and die value.
+# Meant for decisions that take real work to compute, like scoring all candidate moves with
+# a learned evaluator; a tablebase decision is already a lookup and gains nothing from it.
+
+import os                               # for optional files
+import json                             # for persisting
+import hashlib                          # for policy stamps
+from collections import OrderedDict     # for LRU order
+from tablebase import START
+
+
+# Stamp of the policy files (tablebase, evaluator weights) that decisions are made with
+def policy_stamp(*file_names):
+    stamp = hashlib.sha1()
+    for name in file_names:
+        if os.path.exists(name):
+            stamp.update(name.encode())
+            with open(name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    stamp.update(chunk)
+    return stamp.hexdigest()
+
+
+# A decision is stored as the location of the moved peg (START or its position),
+# so it can be mapped back to any slot of game.selected.
+class DecisionCache:
+    def __init__(self, capacity=4096, shared=None, policy=None):
+        self.capacity = capacity
+        # Saved decisions of another policy are not loaded
+        self.policy = policy
+        # Decisions from a frozen cache, e.g. passed to worker processes; only read, never modified
+        self.shared = shared if shared is not None else {}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Canonical key of the current decision and the die value. Players are listed in turn order
+    # starting from the mover, each by its entry relative to the mover entry and its pegs in goal,
+    # in start and on the ring, so the same position of any colors in any seats has the same key.
+    @staticmethod
+    def key(game):
+        ring_count = len(game.ring.slots)
+        entry = game.current_start().entry
+        turn = game.player_turn
+        players = []
+        for p in game.players[turn:] + game.players[:turn]:
+            offset = (game.starts[p.color].entry - entry) % ring_count
+            goals = len([s for s in game.goals[p.color].slots if s.peg])
+            starts = len([s for s in game.starts[p.color].slots if s.peg])
+            ring = tuple(sorted(s.peg.position for s in game.ring.slots if s.peg and s.peg.color == p.color))
+            players.append((offset, goals, starts, ring))
+        return tuple(players), game.current_player().current_dice
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if key in self.shared:
+            self.hits += 1
+            return self.shared[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, loc):
+        self.entries[key] = loc
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # Index of the cached decision in game.selected, None if not cached
+    def lookup(self, game):
+        loc = self.get(self.key(game))
+        if loc is None:
+            return None
+        for i, slot in enumerate(game.selected):
+            if (START if slot.owner == game.current_start() else slot.peg.position) == loc:
+                return i
+        return None
+
+    # Store decision of game.selected[index]
+    def store(self, game, index):
+        slot = game.selected[index]
+        self.put(self.key(game), START if slot.owner == game.current_start() else slot.peg.position)
+
+    # Snapshot of all decisions, to be passed (also pickled to other processes) as 'shared' for other caches
+    def freeze(self):
+        merged = dict(self.shared)
+        merged.update(self.entries)
+        return merged
+
+    def stats(self):
+        return {'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def save(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump({'policy': self.policy,
+                       'decisions': [[k, v] for k, v in self.entries.items()]}, f)
+
+    # Loads saved decisions, unless they were made with another policy
+    def load(self, file_name):
+        def to_tuple(v):
+            return tuple(to_tuple(x) for x in v) if isinstance(v, list) else v
+        with open(file_name, 'r') as f:
+            saved = json.load(f)
+        if not isinstance(saved, dict) or saved.get('policy') != self.policy:
+            return
+        for k, v in saved['decisions']:
+            self.put(to_tuple(k), v)
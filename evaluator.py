@@ -0,0 +1,120 @@
+# Learned move evaluator: a linear model over compact position features.
+# The weights are trained with selfplay.py
+
+import json         # for weights file
+import math         # for sigmoid
+import random       # for shuffling samples
+
+# Die values an opponent peg can hit
+REACH = 6
+FEATURES = ['bias',
+            'own progress', 'own goals', 'own starts',
+            'opponent progress', 'opponent goals', 'opponent starts',
+            'own threatened', 'opponent threatened']
+
+
+# Position of a Game as {color: [pegs in start, pegs in goal, [ring positions]]}
+def snapshot(game):
+    position = {p.color: [0, 0, []] for p in game.players}
+    for color, p in position.items():
+        p[0] = len([s for s in game.starts[color].slots if s.peg])
+        p[1] = len([s for s in game.goals[color].slots if s.peg])
+    for s in game.ring.slots:
+        if s.peg and s.peg.color in position:
+            position[s.peg.color][2].append(s.peg.position)
+    return position
+
+
+# Position after the current player moves the peg from the slot, uses Game.target_slot rules
+def after_move(game, position, slot):
+    target = game.target_slot(slot)
+    moved = {c: [p[0], p[1], list(p[2])] for c, p in position.items()}
+    own = moved[game.current_color()]
+    if slot.owner == game.current_start():
+        own[0] -= 1
+        steps = None
+    else:
+        own[2].remove(slot.peg.position)
+        steps = slot.peg.position + game.current_player().current_dice
+    if target.owner == game.current_goal():
+        own[1] += 1
+        return moved
+    own[2].append(0 if steps is None else steps)
+    if target.peg:
+        eaten = moved[target.peg.color]
+        eaten[2].remove(target.peg.position)
+        eaten[0] += 1
+    return moved
+
+
+# Features of a position from the point of view of a player
+def features(game, position, color):
+    ring_count = len(game.ring.slots)
+    pegs = len(game.starts[color].slots)
+
+    def ring_slots(c):
+        return [(p + game.starts[c].entry) % ring_count for p in position[c][2]]
+
+    def threatened(c):
+        others = [i for o in position if o != c for i in ring_slots(o)]
+        return len([i for i in ring_slots(c) if any(1 <= (i - o) % ring_count <= REACH for o in others)])
+
+    own = position[color]
+    opponents = [o for o in position if o != color]
+    n = max(len(opponents), 1)
+    return [1.0,
+            sum(own[2]) / (ring_count * pegs),
+            own[1] / pegs,
+            own[0] / pegs,
+            sum(sum(position[o][2]) for o in opponents) / (ring_count * pegs * n),
+            sum(position[o][1] for o in opponents) / (pegs * n),
+            sum(position[o][0] for o in opponents) / (pegs * n),
+            threatened(color) / pegs,
+            sum(threatened(o) for o in opponents) / (pegs * n)]
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-max(min(x, 50.0), -50.0)))
+
+
+# Linear value model, estimates the probability that the mover wins
+class Evaluator:
+    def __init__(self, weights=None):
+        self.weights = weights or [0.0] * len(FEATURES)
+
+    # Features of the positions after each move in game.selected
+    def candidates(self, game):
+        position = snapshot(game)
+        color = game.current_color()
+        return [features(game, after_move(game, position, s), color) for s in game.selected]
+
+    # Estimated win probabilities of all moves in game.selected
+    def values(self, game):
+        w = self.weights
+        return [sigmoid(sum(a * b for a, b in zip(w, f))) for f in self.candidates(game)]
+
+    # Index of the best move in game.selected
+    def best_move(self, game):
+        values = self.values(game)
+        return max(range(len(values)), key=values.__getitem__) if values else None
+
+    # Logistic regression with stochastic gradient descent, samples are (features, won)
+    def fit(self, samples, epochs, rate):
+        w = self.weights
+        samples = list(samples)
+        for _ in range(epochs):
+            random.shuffle(samples)
+            for f, won in samples:
+                error = won - sigmoid(sum(a * b for a, b in zip(w, f)))
+                for i, x in enumerate(f):
+                    w[i] += rate * error * x
+
+    def save(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(dict(zip(FEATURES, self.weights)), f, indent=1)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name, 'r') as f:
+            weights = json.load(f)
+        return Evaluator([float(weights[n]) for n in FEATURES])
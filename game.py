@@ -0,0 +1,394 @@
+# Game model: board geometry, slots, pegs and the rules. Does not depend on the UI,
+# drawing is done with any frame composer given to draw functions.
+import math                     # for pi
+import functools                # for some utility functions
+from collections import namedtuple  # for immutable geometry
+
+# The mouse click radius outside drawing radius
+FEATHER = 10
+
+isometric_draw = False
+
+
+# Immutable geometry of a slot, color is the slot color and peg_color of the peg it starts with
+Shape = namedtuple('Shape', ['x', 'y', 'size', 'color', 'peg_color'])
+# Immutable geometry of a start or goals
+HomeShape = namedtuple('HomeShape', ['color', 'entry', 'slots'])
+
+
+# Board geometry, loaded once from the data and shared by all games
+class Geometry:
+    def __init__(self, data):
+        self.width = data['width']
+        self.height = data['height']
+        self.ring = tuple(self.shape(s) for s in data['ring']['slots'])
+        self.starts = tuple(self.home(s) for s in data['starts'])
+        self.goals = tuple(self.home(s) for s in data['goals'])
+
+    @staticmethod
+    def shape(d, color='black'):
+        return Shape(float(d['x']), float(d['y']), float(d['size']), color, d['color'])
+
+    @staticmethod
+    def home(d):
+        return HomeShape(d['color'], int(d['entry']), tuple(Geometry.shape(s, d['color']) for s in d['slots']))
+
+
+# A peg goes in slot
+class Peg:
+    __slots__ = ('color', 'slot', 'position')
+
+    def __init__(self, color, slot):
+        self.color = color
+        self.slot = slot
+        self.position = 0
+
+    def draw(self, frame):
+        frame.begin_path()
+        self.slot.draw_ellipse(frame)
+        frame.fill_style(self.color)
+        frame.fill()
+
+    def reset(self, slot):
+        self.slot.peg = None
+        slot.peg = self
+        self.slot = slot
+        self.position = 0
+
+
+# Game is set of slots, a slot keeps only its state and refers to the shared shape
+# The rules work on slot and peg objects, so a game still has one of each (about 6.5 KB per game).
+class Slot:
+    __slots__ = ('shape', 'owner', 'peg', 'selected', 'hilit')
+
+    def __init__(self, shape, owner):
+        self.shape = shape
+        self.owner = owner
+        self.peg = Peg(shape.peg_color, self) if shape.peg_color else None
+        self.selected = False
+        self.hilit = False
+
+    @property
+    def x(self):
+        return self.shape.x
+
+    @property
+    def y(self):
+        return self.shape.y
+
+    @property
+    def size(self):
+        return self.shape.size
+
+    @property
+    def color(self):
+        return self.shape.color
+
+    def draw_ellipse(self, frame):
+        shape = self.shape
+        if isometric_draw:
+            frame.save()
+            frame.scale(1, 0.5)
+            frame.arc(shape.x, shape.y, shape.size, 0, 2 * math.pi)
+            frame.restore()
+        else:
+            frame.arc(shape.x, shape.y, shape.size, 0, 2 * math.pi)
+
+    def draw(self, frame):
+        frame.begin_path()
+        self.draw_ellipse(frame)
+        frame.stroke_style(self.color)
+        frame.stroke()
+
+        if self.hilit:
+            frame.begin_path()
+            self.draw_ellipse(frame)
+            frame.fill_style('#1B1B1B2F')
+            frame.fill()
+
+        if self.selected:
+            frame.begin_path()
+            self.draw_ellipse(frame)
+            frame.stroke_style('#2F2F2F')
+            frame.stroke()
+
+        if self.peg:
+            self.peg.draw(frame)
+
+    def is_in(self, x, y):
+        shape = self.shape
+        return math.fabs(shape.x - x) <= (shape.size + FEATHER) \
+               and math.fabs(shape.y - y) <= (shape.size + FEATHER)
+
+    def move(self, other, steps):
+        assert self.peg
+        assert not other.peg
+        self.peg.position += steps
+        self.peg.slot = other
+        other.peg = self.peg
+        self.peg = None
+
+
+class Ring:
+    __slots__ = ('slots',)
+
+    def __init__(self, shapes):
+        self.slots = [Slot(s, self) for s in shapes]
+
+    def draw(self, frame):
+        for s in self.slots:
+            s.draw(frame)
+
+    def slot_at(self, x, y):
+        for s in self.slots:
+            if s.is_in(x, y):
+                return s
+        return None
+
+    def activate(self, color, target):
+        selected = []
+        for s in self.slots:
+            if s.peg and s.peg.color == color and target(s):
+                s.selected = True
+                selected.append(s)
+            else:
+                s.selected = False
+        return selected
+
+    def deactivate(self):
+        for s in self.slots:
+            s.selected = False
+
+
+class Home:
+    __slots__ = ('color', 'entry', 'slots')
+
+    def __init__(self, home):
+        self.color = home.color
+        self.entry = home.entry
+        self.slots = [Slot(s, self) for s in home.slots]
+
+    def draw(self, frame):
+        for s in self.slots:
+            s.draw(frame)
+
+    def slot_at(self, x, y):
+        for s in self.slots:
+            if s.is_in(x, y):
+                return s
+        return None
+
+    def count(self):
+        return len([s for s in self.slots if s.peg])
+
+
+class Start(Home):
+    __slots__ = ()
+
+    def __init__(self, home):
+        super().__init__(home)
+
+    def activate(self, target):
+        for s in self.slots:
+            if s.peg and target(s):
+                s.selected = True
+                return s
+        return None
+
+    def deactivate(self):
+        for s in self.slots:
+            s.selected = False
+
+    def is_active(self):
+        return functools.reduce(lambda a, b: a or b, self.slots)
+
+    def return_home(self, peg):
+        for s in self.slots:
+            if not s.peg:
+                peg.reset(s)
+                return
+
+
+class Goals(Home):
+    __slots__ = ()
+
+    def __init__(self, home):
+        super().__init__(home)
+
+    def is_full(self):
+        return len([s for s in self.slots if s.peg]) == len(self.slots)
+
+
+class Player:
+    def __init__(self, color, name):
+        self.color = color
+        self.name = name.rstrip()
+        self.current_dice = -1
+
+
+class Game:
+    START = 1
+    PICK_MOVER = 2
+    SELECT_STARTER = 3
+    NEXT_TURN = 4
+    GAME_OVER = 5
+
+    NEW_RING = 6
+    MIN_PLAYERS = 2
+
+    def __init__(self, geometry, help_function):
+        self.width = geometry.width
+        self.height = geometry.height
+        self.ring = Ring(geometry.ring)
+        self.starts = {s.color: Start(s) for s in geometry.starts}
+        self.goals = {s.color: Goals(s) for s in geometry.goals}
+        self.state = self.START
+        self.players = []
+        self.player_turn = 0
+        self.help = help_function
+        self.is_new_ring = False
+        self.selected = None
+
+    def draw(self, frame_composer):
+        self.ring.draw(frame_composer)
+        for s in self.starts.values():
+            s.draw(frame_composer)
+        for g in self.goals.values():
+            g.draw(frame_composer)
+
+    def slot_at(self, x, y):
+        return self.ring.slot_at(x, y) or self.current_start().slot_at(x, y) or self.current_goal().slot_at(x, y)
+
+    def clicked(self, x, y):
+        assert self.state == self.PICK_MOVER
+        self.selected = None
+        slot = self.slot_at(x, y)
+        print("hit at", slot, slot.peg.color if slot and slot.peg else "Empty")
+        if slot and slot.peg and slot.peg.color == self.current_player().color and (
+                self.is_new_ring or slot.owner == self.ring):
+            return self.move(slot)
+        return False
+
+    # Move the current player peg from the slot, returns True if the game goes on
+    def move(self, slot):
+        self.selected = None
+        target = self.target_slot(slot)
+        if not target:
+            return False
+        if target.peg:
+            self.starts[target.peg.color].return_home(target.peg)
+        self.ring.deactivate()
+        self.current_start().deactivate()
+        if slot.owner == self.current_start():
+            slot.move(target, 0)
+        else:
+            slot.move(target, self.current_player().current_dice)
+        self.state = self.NEXT_TURN
+        if self.is_new_ring:
+            return True
+        return self.turn_inc()
+
+    def player(self, color):
+        for n in self.players:
+            if n.color == color:
+                return n
+        return None
+
+    def current_player(self):
+        return self.players[self.player_turn] if self.player_turn < len(self.players) else None
+
+    def set_players(self, player_names):
+        self.players = [Player(p, player_names[p]) for p in player_names if player_names[p]]
+        if len(self.players) < self.MIN_PLAYERS:
+            return
+        self.state = self.SELECT_STARTER
+        self.player_turn = 0
+        self.help(self.current_player().name.capitalize() + " throws the dice to see who will be the first.")
+
+    def current_color(self):
+        return self.current_player().color if self.current_player() else 'white'
+
+    def current_start(self):
+        return self.starts[self.current_player().color]
+
+    def current_goal(self):
+        return self.goals[self.current_player().color]
+
+    def turn_inc(self):
+        self.player_turn += 1
+        if self.player_turn >= len(self.players):
+            for k in self.goals:
+                if self.goals[k].is_full():
+                    self.help(self.player(k).name + " won!")
+                    self.state = self.GAME_OVER
+                    return False
+            self.player_turn = 0
+        return True
+
+    def dice_thrown(self, value):
+        self.is_new_ring = value == self.NEW_RING
+        self.players[self.player_turn].current_dice = value
+        if self.state == self.SELECT_STARTER:
+            self.turn_inc()
+            if len([s for s in self.players if s.current_dice < 1]) == 0:
+                self.players.sort(key=lambda x: x.current_dice, reverse=True)
+                self.state = self.NEXT_TURN
+                self.player_turn = 0
+                self.help(self.current_player().name.capitalize() + " will start the game!")
+            else:
+                self.help(self.current_player().name.capitalize() + " throws the dice to see who will be the first.")
+            return True
+        elif self.state == self.NEXT_TURN:
+            assert not self.selected
+            self.selected = self.ring.activate(self.current_player().color, self.target_slot)
+            if value == self.NEW_RING:
+                activated_start = self.current_start().activate(self.target_slot)
+                if activated_start:
+                    self.selected.append(activated_start)
+            if len(self.selected) == 0:
+                if self.turn_inc():
+                    self.help("Cannot move, pass turn to " + self.current_player().name.capitalize())
+                return True
+            self.help(self.current_player().name.capitalize() + " do your move.")
+            self.state = self.PICK_MOVER
+        elif self.state == self.PICK_MOVER:
+            None
+        return False
+
+    def target_slot(self, slot):
+        assert slot.peg  # Slot must have a color!
+        assert slot.peg.color == self.current_color()  # Assumed that same as the current color!
+        assert 1 <= self.current_player().current_dice <= 6  # Shall have a valid die value!
+
+        # If slot in ring
+        if slot.owner == self.ring:
+            slot_count = len(self.ring.slots)
+            target_pos = slot.peg.position + self.current_player().current_dice
+            if target_pos < slot_count:
+                position = (target_pos + self.current_start().entry) % slot_count
+                if not self.ring.slots[position].peg or self.ring.slots[position].peg.color != self.current_color():
+                    return self.ring.slots[position]
+            # It tries to go goal
+            else:
+                goal_position = target_pos - slot_count
+                # if we can fit it in
+                if goal_position < len(self.current_goal().slots) and not self.current_goal().slots[goal_position].peg:
+                    return self.current_goal().slots[goal_position]
+                # is it one of starts, and can we go (or event eat)?
+        elif slot.owner == self.current_start() and self.current_start().is_active():
+            start_pos = self.current_start().entry
+            if not self.ring.slots[start_pos].peg or self.ring.slots[start_pos].peg.color != self.current_color():
+                return self.ring.slots[start_pos]
+        return None
+
+    def get_activated(self):
+        return [s for s in self.ring.slots if s.selected] + [s for s in self.current_start().slots if s.selected]
+
+    @staticmethod
+    def set_draw_mode(mode):
+        global isometric_draw
+        isometric_draw = True if mode == 'isometric' else False
+
+    @staticmethod
+    def is_isometric():
+        return isometric_draw
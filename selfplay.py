@@ -0,0 +1,86 @@
+# Trains the move evaluator by self-play:
+#   python selfplay.py [iterations] [games per batch] [weights file]
+# Each iteration plays a batch of games with the current evaluator and fits it to their outcomes.
+
+import sys          # for command line
+import json         # for reading json files
+import random       # for dice values and exploration
+from game import Game, Geometry
+from evaluator import Evaluator, snapshot, features
+from decisions import DecisionCache
+
+# Probability of a random move, so that the evaluator sees also other than its own choices
+EXPLORE = 0.1
+# Game is abandoned after this many throws
+MAX_THROWS = 5000
+EPOCHS = 5
+LEARNING_RATE = 0.05
+# Decisions cached within a batch, the evaluator does not change until the batch is played
+CACHE_SIZE = 100000
+
+
+# The color that has won a game over, checked in the same order as Game.turn_inc does
+def winner(game):
+    for k in game.goals:
+        if game.goals[k].is_full():
+            return k
+    return None
+
+
+# Plays a game with all players using the evaluator, returns (features, color) of each decision and the winner.
+# Evaluator decisions go through the cache, which is valid as long as the evaluator is not refitted.
+def play(geometry, evaluator, cache, colors):
+    game = Game(geometry, lambda _: None)
+    game.set_players({c: c for c in colors})
+    decisions = []
+    for _ in range(MAX_THROWS):
+        if game.state == game.GAME_OVER:
+            return decisions, winner(game)
+        game.dice_thrown(random.randint(1, 6))
+        if game.state != game.PICK_MOVER:
+            continue
+        color = game.current_color()
+        if len(game.selected) > 1 and random.random() >= EXPLORE:
+            best = cache.lookup(game)
+            if best is None:
+                best = evaluator.best_move(game)
+                cache.store(game, best)
+        else:
+            best = random.randint(0, len(game.selected) - 1)
+        slot = game.selected[best]
+        game.move(slot)
+        decisions.append((features(game, snapshot(game), color), color))
+    return decisions, None
+
+
+def play_batch(geometry, evaluator, games):
+    colors = [s.color for s in geometry.starts]
+    cache = DecisionCache(CACHE_SIZE)
+    samples = []
+    wins = 0
+    for _ in range(games):
+        players = random.sample(colors, random.randint(Game.MIN_PLAYERS, len(colors)))
+        decisions, won = play(geometry, evaluator, cache, players)
+        if won is None:
+            continue
+        wins += 1
+        samples += [(f, 1.0 if c == won else 0.0) for f, c in decisions]
+    return samples, wins, cache.stats()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    games = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    weights_file = sys.argv[3] if len(sys.argv) > 3 else 'gui/evaluator.json'
+    with open("gui/data.json", 'r') as f:
+        geometry = Geometry(json.load(f))
+    evaluator = Evaluator()
+    for i in range(iterations):
+        samples, finished, stats = play_batch(geometry, evaluator, games)
+        evaluator.fit(samples, EPOCHS, LEARNING_RATE)
+        print("iteration", i, "games", finished, "samples", len(samples), "cache", stats, file=sys.stderr)
+    evaluator.save(weights_file)
+
+
+if __name__ == "__main__":
+    main()
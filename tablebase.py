@@ -0,0 +1,326 @@
+# Endgame tablebase: exact win probabilities of two player endgames.
+#
+# Run as a script to generate the table for the board in gui/data.json:
+#   python tablebase.py [pegs] [other pegs] [data file] [table file]
+# One player may still have at most 'pegs' (2) pegs outside its goals and the other at most
+# 'other pegs' (1), so the player with more pegs has real choices to make.
+# The board can then load the table and use it for auto-play decisions.
+
+import sys          # for command line
+import json         # for reading json files
+import mmap         # for mapping the table file
+import struct       # for the table header
+import itertools    # for enumerating positions
+from array import array
+
+MAGIC = b'TIMPLETB'
+# magic, pegs, other pegs, ring slot count, goal slot count, info length
+HEADER = struct.Struct('<8sIIIII')
+# Location of a peg that is waiting in its start
+START = -1
+# Die value that let a peg out of the start and gives an extra throw
+NEW_RING = 6
+DIE_VALUES = range(1, 7)
+# Solver stops when no value changes more than this, values are stored as float32
+PRECISION = 1e-7
+# Outcomes of finished games, negative so they never clash with an index
+FIRST_WON = -2
+SECOND_WON = -1
+
+
+# Every position of a single player: a bit mask of occupied goal slots and
+# a sorted tuple of locations of pegs outside the goals.
+# The index of a position in this list is its perfect hash. Positions are listed by
+# the number of pegs outside, so positions of fewer pegs are a prefix of the list.
+def player_positions(pegs, ring_count, goal_count):
+    positions = []
+    for outside in range(0, min(pegs, goal_count) + 1):
+        for filled in itertools.combinations(range(goal_count), goal_count - outside):
+            mask = sum(1 << g for g in filled)
+            for locs in itertools.combinations_with_replacement(range(START, ring_count), outside):
+                on_ring = [p for p in locs if p != START]
+                if len(on_ring) == len(set(on_ring)):
+                    positions.append((mask, locs))
+    return positions
+
+
+# Board dimensions needed by the rules
+class Layout:
+    def __init__(self, ring_count, goal_count):
+        self.ring_count = ring_count
+        self.goal_count = goal_count
+        self.full = (1 << goal_count) - 1
+
+    # Ring slot index of a peg that has moved 'position' steps from its entry
+    def ring_index(self, position, entry):
+        return (position + entry) % self.ring_count
+
+    # Move the peg at 'loc' of 'own' by 'die', same as Game.target_slot does.
+    # Returns new (own, other) positions or None if the peg cannot move.
+    def move(self, own, own_entry, other, other_entry, loc, die):
+        mask, locs = own
+        if loc == START:
+            if die != NEW_RING:
+                return None
+            target = 0
+        else:
+            target = loc + die
+        if target >= self.ring_count:
+            goal = target - self.ring_count
+            if goal >= self.goal_count or mask & (1 << goal):
+                return None
+            rest = list(locs)
+            rest.remove(loc)
+            return (mask | (1 << goal), tuple(rest)), other
+        if target in locs:
+            return None  # cannot eat own peg
+        rest = list(locs)
+        rest.remove(loc)
+        own = (mask, tuple(sorted(rest + [target])))
+        index = self.ring_index(target, own_entry)
+        other_mask, other_locs = other
+        for p in other_locs:
+            if p != START and self.ring_index(p, other_entry) == index:
+                eaten = list(other_locs)
+                eaten.remove(p)
+                other = (other_mask, tuple(sorted(eaten + [START])))
+                break
+        return own, other
+
+    # All distinct positions the mover can reach with 'die'
+    def moves(self, own, own_entry, other, other_entry, die):
+        moved = (self.move(own, own_entry, other, other_entry, loc, die) for loc in sorted(set(own[1])))
+        return [m for m in moved if m]
+
+    def is_valid(self, first, first_entry, second, second_entry):
+        first_ring = {self.ring_index(p, first_entry) for p in first[1] if p != START}
+        return not any(self.ring_index(p, second_entry) in first_ring for p in second[1] if p != START)
+
+
+# Index arithmetic shared by the generator and the reader.
+# Only the distance between entries of the players and the order in which their goals are
+# checked affect the values, so each such class of color pairs is solved once.
+# Within a class, positions are indexed by turn and the ranks of both players, where
+# the rank of at least one of them is below 'small'.
+class Indexer:
+    def __init__(self, pegs, other_pegs, layout, colors, entries):
+        self.layout = layout
+        self.positions = player_positions(max(pegs, other_pegs), layout.ring_count, layout.goal_count)
+        self.small = len(player_positions(min(pegs, other_pegs), layout.ring_count, layout.goal_count))
+        self.ranks = {p: i for i, p in enumerate(self.positions)}
+        self.colors = colors
+        self.entries = entries
+        self.pair_classes = {}
+        self.classes = []
+        for first, second in itertools.permutations(colors, 2):
+            c = ((entries[second] - entries[first]) % layout.ring_count, colors.index(first) < colors.index(second))
+            if c not in self.classes:
+                self.classes.append(c)
+            self.pair_classes[(first, second)] = self.classes.index(c)
+        big = len(self.positions)
+        self.turn_size = big * self.small + self.small * (big - self.small)
+        self.class_size = 2 * self.turn_size
+
+    # Offset of ranks within a turn, None if neither player is small enough
+    def offset(self, first, second):
+        if second < self.small:
+            return first * self.small + second
+        if first < self.small:
+            return len(self.positions) * self.small + first * (len(self.positions) - self.small) + second - self.small
+        return None
+
+    # Index of a position within its class, where 'turn' (0 or 1) is about to throw, players in turn order
+    def index(self, turn, first, second):
+        offset = self.offset(self.ranks[first], self.ranks[second])
+        return None if offset is None else turn * self.turn_size + offset
+
+    # Winner (0 or 1) when the round ends, None if the game goes on.
+    # As in Game.turn_inc, goals are checked in the data file order.
+    def round_winner(self, cls, first, second):
+        first_full = first[0] == self.layout.full
+        second_full = second[0] == self.layout.full
+        if first_full and second_full:
+            return 0 if self.classes[cls][1] else 1
+        if first_full or second_full:
+            return 0 if first_full else 1
+        return None
+
+    # Index, FIRST_WON or SECOND_WON after a move of 'die', players in turn order
+    def outcome(self, cls, turn, die, first, second):
+        if die == NEW_RING:
+            return self.index(turn, first, second)
+        return self.turn_over(cls, turn, first, second)
+
+    # Index, FIRST_WON or SECOND_WON when the turn of 'turn' is over
+    def turn_over(self, cls, turn, first, second):
+        if turn == 0:
+            return self.index(1, first, second)
+        winner = self.round_winner(cls, first, second)
+        if winner is None:
+            return self.index(0, first, second)
+        return FIRST_WON if winner == 0 else SECOND_WON
+
+    # Positions of both players in turn order after each legal move of 'die'
+    def moves(self, cls, turn, die, first, second, loc=None):
+        entries = 0, self.classes[cls][0]
+        own, other = (first, second) if turn == 0 else (second, first)
+        if loc is None:
+            moved = self.layout.moves(own, entries[turn], other, entries[1 - turn], die)
+        else:
+            moved = [m for m in [self.layout.move(own, entries[turn], other, entries[1 - turn], loc, die)] if m]
+        return moved if turn == 0 else [(f, s) for s, f in moved]
+
+
+# Solves probabilities of the first player to win, for every position of every class
+def solve(indexer):
+    layout = indexer.layout
+    result = array('f')
+    for cls in range(len(indexer.classes)):
+        entries = 0, indexer.classes[cls][0]
+        # Flat node data: index of each position, for each of its throws the range of outcomes
+        nodes = array('l')
+        bounds = array('l', [0])
+        outcomes = array('l')
+        for turn in (0, 1):
+            for first in indexer.positions:
+                for second in indexer.positions:
+                    index = indexer.index(turn, first, second)
+                    if index is None or not layout.is_valid(first, entries[0], second, entries[1]):
+                        continue
+                    nodes.append(index)
+                    for die in DIE_VALUES:
+                        moved = indexer.moves(cls, turn, die, first, second)
+                        if moved:
+                            outcomes.extend(indexer.outcome(cls, turn, die, f, s) for f, s in moved)
+                        else:
+                            outcomes.append(indexer.turn_over(cls, turn, first, second))
+                        bounds.append(len(outcomes))
+
+        # Last two cells hold FIRST_WON and SECOND_WON
+        values = array('d', [0.0]) * (indexer.class_size + 2)
+        values[FIRST_WON] = 1.0
+        turn_size = indexer.turn_size
+        throws = len(DIE_VALUES)
+
+        # Gauss-Seidel value iteration, captures make the position graph cyclic
+        delta = 1.0
+        while delta > PRECISION:
+            delta = 0.0
+            for n, index in enumerate(nodes):
+                total = 0.0
+                for t in range(n * throws, (n + 1) * throws):
+                    begin = bounds[t]
+                    end = bounds[t + 1]
+                    if end - begin == 1:
+                        total += values[outcomes[begin]]
+                    elif index < turn_size:
+                        total += max([values[outcomes[i]] for i in range(begin, end)])
+                    else:
+                        total += min([values[outcomes[i]] for i in range(begin, end)])
+                value = total / throws
+                if abs(value - values[index]) > delta:
+                    delta = abs(value - values[index])
+                values[index] = value
+        result.extend(array('f', values[:indexer.class_size]))
+        print("solved", indexer.classes[cls], file=sys.stderr)
+    return result
+
+
+def write(file_name, indexer, pegs, other_pegs, values):
+    info = json.dumps({'colors': indexer.colors, 'entries': indexer.entries}).encode()
+    info += b' ' * (-len(info) % 4)  # keep table aligned
+    with open(file_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, pegs, other_pegs, indexer.layout.ring_count, indexer.layout.goal_count,
+                            len(info)))
+        f.write(info)
+        values.tofile(f)
+
+
+# Memory mapped table, positions are looked up from a Game
+class Tablebase:
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, pegs, other_pegs, ring_count, goal_count, info_len = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(file_name + " is not a tablebase")
+        info = json.loads(self.map[HEADER.size:HEADER.size + info_len])
+        layout = Layout(ring_count, goal_count)
+        self.indexer = Indexer(pegs, other_pegs, layout, info['colors'], info['entries'])
+        self.values = memoryview(self.map)[HEADER.size + info_len:].cast('f')
+
+    def close(self):
+        self.values.release()
+        self.map.close()
+
+    # True if the table was generated for the board geometry, a table of another board picks wrong moves
+    def matches(self, geometry):
+        layout = self.indexer.layout
+        return layout.ring_count == len(geometry.ring) \
+            and layout.goal_count == min(len(g.slots) for g in geometry.goals) \
+            and self.indexer.colors == [g.color for g in geometry.goals] \
+            and self.indexer.entries == {s.color: s.entry for s in geometry.starts}
+
+    # Position of a player in a Game, None if it does not fit in the table
+    def player_position(self, game, color):
+        mask = sum(1 << i for i, s in enumerate(game.goals[color].slots) if s.peg)
+        locs = [START for s in game.starts[color].slots if s.peg]
+        locs += [s.peg.position for s in game.ring.slots if s.peg and s.peg.color == color]
+        position = (mask, tuple(sorted(locs)))
+        return position if position in self.indexer.ranks else None
+
+    # The class and positions of a Game in turn order, None if not in the table
+    def positions(self, game):
+        if len(game.players) != 2:
+            return None
+        cls = self.indexer.pair_classes.get(tuple(p.color for p in game.players))
+        if cls is None:
+            return None
+        first, second = (self.player_position(game, p.color) for p in game.players)
+        if first is None or second is None or self.indexer.index(0, first, second) is None:
+            return None
+        return cls, first, second
+
+    # Probability of the first player to win
+    def value(self, cls, outcome):
+        if outcome < 0:
+            return 1.0 if outcome == FIRST_WON else 0.0
+        return self.values[cls * self.indexer.class_size + outcome]
+
+    # Index of the best move in game.selected, None if the position is not in the table
+    def best_move(self, game):
+        found = self.positions(game)
+        if not found or not game.selected:
+            return None
+        cls, first, second = found
+        turn = game.player_turn
+        die = game.current_player().current_dice
+        best = None
+        for i, slot in enumerate(game.selected):
+            loc = START if slot.owner == game.current_start() else slot.peg.position
+            moved = self.indexer.moves(cls, turn, die, first, second, loc)
+            if not moved:
+                continue
+            value = self.value(cls, self.indexer.outcome(cls, turn, die, *moved[0]))
+            value = value if turn == 0 else 1.0 - value
+            if best is None or value > best[1]:
+                best = i, value
+        return best[0] if best else None
+
+
+def main():
+    pegs = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    other_pegs = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    data_file = sys.argv[3] if len(sys.argv) > 3 else 'gui/data.json'
+    table_file = sys.argv[4] if len(sys.argv) > 4 else 'gui/endgame.tb'
+    with open(data_file, 'r') as f:
+        data = json.load(f)
+    layout = Layout(len(data['ring']['slots']), min(len(g['slots']) for g in data['goals']))
+    colors = [g['color'] for g in data['goals']]
+    entries = {s['color']: int(s['entry']) for s in data['starts']}
+    indexer = Indexer(pegs, other_pegs, layout, colors, entries)
+    write(table_file, indexer, pegs, other_pegs, solve(indexer))
+
+
+if __name__ == "__main__":
+    main()